@@ -1,107 +1,489 @@
+import atexit
+import fcntl
+import hashlib
+import io
 import os
 import time
 import tempfile
+import uuid
 import subprocess
 import logging
+import logging.handlers
 import json
-from flask import Flask, request, jsonify
+import queue
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, Request, Response, request
 import numpy as np
 
-# Configure logging
+# Configure logging. Records are written out by a background listener, so
+# request threads never block on the stream. Set GPD_LOG_LEVEL=DEBUG to also
+# log the GPD workers' output.
+log_handler = logging.StreamHandler()
+log_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+log_queue = queue.Queue()
+log_listener = logging.handlers.QueueListener(log_queue, log_handler)
+queue_handler = logging.handlers.QueueHandler(log_queue)
+# Only merge the message arguments here; the listener applies the real format
+queue_handler.setFormatter(logging.Formatter('%(message)s'))
 logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    level=os.environ.get("GPD_LOG_LEVEL", "INFO").upper(),
+    handlers=[queue_handler]
 )
+log_listener.start()
+atexit.register(log_listener.stop)
 logger = logging.getLogger(__name__)
 
 # Flask application
 app = Flask(__name__)
-app.config['DEBUG'] = True
 
 # GPD settings
 WORKING_DIR = "/opt/gpd/build"
 CONFIG_DIR = "/workspace/cfg"
 CONFIG_FILE = os.path.join(CONFIG_DIR, "eigen_params.cfg")
+EXECUTABLE = os.path.join(WORKING_DIR, "detect_grasps")
+BUILD_CFG_DIR = os.path.join(WORKING_DIR, "cfg")
+HAND_GEOMETRY_SRC = os.path.join(CONFIG_DIR, "hand_geometry.cfg")
+HAND_GEOMETRY_DST = os.path.join(BUILD_CFG_DIR, "hand_geometry.cfg")
+IMAGE_GEOMETRY_SRC = os.path.join(CONFIG_DIR, "image_geometry_15channels.cfg")
+IMAGE_GEOMETRY_DST = os.path.join(BUILD_CFG_DIR, "image_geometry_15channels.cfg")
+
+# Uploaded clouds are only handed to GPD, so keep them in RAM-backed tmpfs
+TEMP_DIR = os.environ.get("GPD_TEMP_DIR", "/dev/shm")
+if not os.path.isdir(TEMP_DIR):
+    TEMP_DIR = None
+
+# Larger request bodies are rejected before anything is written
+MAX_UPLOAD_SIZE = int(os.environ.get("GPD_MAX_UPLOAD_MB", "512")) * 1024 * 1024
+
+class GpdRequest(Request):
+    """Request that streams uploaded files straight into PCD files in TEMP_DIR.
+
+    The files are deleted when the request is closed, so the detection handler
+    can pass their names to GPD without saving the upload a second time.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None,
+                         content_length=None):
+        temp_dir = TEMP_DIR
+        if temp_dir is not None and total_content_length:
+            # Docker's /dev/shm is only 64 MiB unless the container is run with
+            # --shm-size; rather than fail with ENOSPC mid-upload, spill uploads
+            # that don't fit to the default temporary directory
+            stat = os.statvfs(temp_dir)
+            if stat.f_bavail * stat.f_frsize < total_content_length:
+                logger.warning("Not enough space in %s for a %s byte upload, using %s",
+                               temp_dir, total_content_length, tempfile.gettempdir())
+                temp_dir = None
+        return tempfile.NamedTemporaryFile(prefix='input_cloud_', suffix='.pcd', dir=temp_dir)
+
+app.request_class = GpdRequest
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_SIZE
+
+# Worker pool settings
+NUM_WORKERS = int(os.environ.get("GPD_NUM_WORKERS", "2"))
+if NUM_WORKERS < 1:
+    raise RuntimeError("GPD_NUM_WORKERS must be at least 1, got {0}".format(NUM_WORKERS))
+QUEUE_TIMEOUT = float(os.environ.get("GPD_QUEUE_TIMEOUT", "60"))
+# Optional CPU list (e.g. "0-7" or "0-3,8-11") for the server and its workers,
+# usually the CPUs of one NUMA node, so the scheduler doesn't migrate them
+CPU_AFFINITY = os.environ.get("GPD_CPU_AFFINITY", "")
+WORKER_READY = b"======== READY ========"
+WORKER_DONE = b"======== DONE ========"
+WORKER_FAILED = b"======== FAILED ========"
+SELECTED_GRASPS_BANNER = b"======== Selected grasps ========"
+RUNTIMES_BANNER = b"======== RUNTIMES ========"
+GRASP_LINE_PATTERN = re.compile(rb"^[ \t]*Grasp[ \t]+(\d+):[ \t]*(\S+)[ \t\r]*$", re.MULTILINE)
+# Worker pipes are grown to this size so verbose GPD output needs fewer wakeups,
+# and stdout is read in blocks of the same size rather than the default 8 KiB
+PIPE_SIZE = 1024 * 1024
+F_SETPIPE_SZ = getattr(fcntl, "F_SETPIPE_SZ", 1031)  # Linux only, not exposed before Python 3.10
+
+def parse_cpu_list(spec):
+    """Parse a CPU list such as "0-3,8" into a set of CPU ids."""
+    cpus = set()
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            first, last = part.split("-")
+            cpus.update(range(int(first), int(last) + 1))
+        else:
+            cpus.add(int(part))
+    return cpus
+
+CPU_SET = parse_cpu_list(CPU_AFFINITY)
+
+class WorkerError(Exception):
+    """Raised when a GPD worker process dies or stops responding."""
+
+class DetectionError(Exception):
+    """Raised when GPD could not detect grasps in a cloud (e.g. an empty or unreadable file)."""
+
+class PoolBusyError(Exception):
+    """Raised when no GPD worker became free within the queue timeout."""
+
+class GpdWorker(object):
+    """A persistent detect_grasps process running in server mode."""
+
+    def __init__(self):
+        self.process = None
+        self.start()
+
+    def start(self):
+        """Launch the worker and wait until the detector is loaded."""
+        # Descriptors opened by Python are non-inheritable (PEP 446), so the
+        # child-side sweep that close_fds=True does is pure overhead here. On
+        # Python >= 3.8 it is also what keeps subprocess off posix_spawn().
+        self.process = subprocess.Popen(
+            [EXECUTABLE, "--server", CONFIG_FILE],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            cwd=WORKING_DIR,
+            close_fds=False,
+            bufsize=PIPE_SIZE
+        )
+        for pipe in (self.process.stdout, self.process.stderr):
+            try:
+                fcntl.fcntl(pipe.fileno(), F_SETPIPE_SZ, PIPE_SIZE)
+            except OSError as e:
+                logger.debug("Could not resize worker pipe: %s", e)
+        if CPU_SET:
+            # Pinned from here rather than in a preexec_fn, which isn't thread-safe
+            os.sched_setaffinity(self.process.pid, CPU_SET)
+        # Drain stderr in the background so a chatty worker can never block on it
+        stderr_thread = threading.Thread(target=self._log_stderr, args=(self.process,))
+        stderr_thread.daemon = True
+        stderr_thread.start()
+        self._read_until(WORKER_READY)
+        logger.info("Started GPD worker (pid %s)", self.process.pid)
+
+    def is_alive(self):
+        return self.process.poll() is None
+
+    def stop(self):
+        """Ask the worker to exit by closing its stdin, killing it if it hangs."""
+        self.process.stdin.close()
+        try:
+            self.process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+    def restart(self):
+        """Kill the worker (if still alive) and launch a fresh one."""
+        if self.process is not None and self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+        self.start()
+
+    def detect(self, pcd_path):
+        """Run grasp detection on a PCD file and return the raw selected-grasps output."""
+        try:
+            self.process.stdin.write(pcd_path.encode('utf-8') + b"\n")
+            self.process.stdin.flush()
+        except (BrokenPipeError, OSError) as e:
+            raise WorkerError("Could not send request to GPD worker: {0}".format(str(e)))
+        return self._read_until(WORKER_DONE, keep_from=SELECTED_GRASPS_BANNER,
+                                keep_until=RUNTIMES_BANNER, failed_banner=WORKER_FAILED)
+
+    def _read_until(self, banner, keep_from=None, keep_until=None, failed_banner=None):
+        """Consume output up to `banner`, returning the lines from `keep_from`
+        up to (not including) `keep_until`.
+
+        Raises DetectionError if `failed_banner` comes first; the worker is
+        still usable then, only the request failed.
+
+        Everything else is only logged (at DEBUG) as it arrives, so the
+        worker's progress output is never buffered as a whole.
+        """
+        lines = []
+        keep = False
+        debug = logger.isEnabledFor(logging.DEBUG)
+        while True:
+            line = self.process.stdout.readline()
+            if not line:
+                raise WorkerError("GPD worker exited with code {0}".format(self.process.poll()))
+            if line.rstrip() == banner:
+                return b"".join(lines)
+            if failed_banner is not None and line.rstrip() == failed_banner:
+                raise DetectionError("Input point cloud is empty or could not be read")
+            if debug:
+                logger.debug("GPD worker: %s", line.rstrip().decode('utf-8', 'replace'))
+            if keep_from is not None and line.startswith(keep_from):
+                keep = True
+            elif keep and keep_until is not None and line.startswith(keep_until):
+                keep = False
+                keep_from = None
+            if keep:
+                lines.append(line)
+
+    @staticmethod
+    def _log_stderr(process):
+        for line in iter(process.stderr.readline, b""):
+            logger.warning("GPD worker stderr: %s", line.decode('utf-8', 'replace').rstrip())
+
+class WorkerPool(object):
+    """Fixed set of pre-warmed GPD workers shared by all requests."""
+
+    def __init__(self, size):
+        self._workers = [GpdWorker() for _ in range(size)]
+        self._idle = queue.Queue()
+        for worker in self._workers:
+            self._idle.put(worker)
+
+    def acquire(self, timeout=None):
+        try:
+            return self._idle.get(timeout=timeout)
+        except queue.Empty:
+            raise PoolBusyError("No GPD worker became free within {0} seconds".format(timeout))
+
+    def release(self, worker):
+        self._idle.put(worker)
+
+    def detect(self, pcd_path, timeout=None):
+        """Run detection on an idle worker, restarting it if it broke."""
+        worker = self.acquire(timeout)
+        try:
+            if not worker.is_alive():
+                logger.warning("GPD worker (pid %s) died while idle, restarting it", worker.process.pid)
+                worker.restart()
+            return worker.detect(pcd_path)
+        except WorkerError:
+            logger.error("GPD worker failed, restarting it")
+            worker.restart()
+            raise
+        finally:
+            self.release(worker)
+
+    def close(self):
+        """Shut down all workers."""
+        for worker in self._workers:
+            worker.stop()
+
+def copy_file(src, dst):
+    """Copy `src` to `dst` in the kernel with sendfile(), without a userspace buffer."""
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        size = os.fstat(fsrc.fileno()).st_size
+        offset = 0
+        while offset < size:
+            sent = os.sendfile(fdst.fileno(), fsrc.fileno(), offset, size - offset)
+            if sent == 0:
+                break
+            offset += sent
+
+def link_config_file(src, dst):
+    """Make `src` available at `dst`, copying its contents only as a last resort."""
+    if os.path.lexists(dst):
+        return
+    try:
+        os.link(src, dst)
+    except OSError:
+        # Hard links can't cross filesystems, e.g. from the /workspace bind mount
+        try:
+            os.symlink(src, dst)
+        except OSError:
+            # Some filesystems (e.g. certain network mounts) support neither
+            copy_file(src, dst)
+            logger.debug("Copied %s to %s", src, dst)
+            return
+    logger.debug("Linked %s to %s", src, dst)
+
 def copy_config_files():
-    """Copy required config files to the build directory."""
+    """Make the required config files available in the build directory."""
     try:
-        # Check if config files already exist in build directory
-        if not os.path.exists(os.path.join(WORKING_DIR, "cfg")):
-            # Python 3.5 doesn't have exist_ok parameter
-            try:
-                os.makedirs(os.path.join(WORKING_DIR, "cfg"))
-            except OSError:
-                if not os.path.isdir(os.path.join(WORKING_DIR, "cfg")):
-                    raise
-            
-        # Copy hand geometry config if needed
-        hand_geometry_src = os.path.join(CONFIG_DIR, "hand_geometry.cfg")
-        hand_geometry_dst = os.path.join(WORKING_DIR, "cfg", "hand_geometry.cfg")
-        if not os.path.exists(hand_geometry_dst):
-            with open(hand_geometry_src, 'r') as src, open(hand_geometry_dst, 'w') as dst:
-                dst.write(src.read())
-            logger.debug("Copied hand geometry config to {0}".format(hand_geometry_dst))
-            
-        # Copy image geometry config if needed
-        img_geometry_src = os.path.join(CONFIG_DIR, "image_geometry_15channels.cfg")
-        img_geometry_dst = os.path.join(WORKING_DIR, "cfg", "image_geometry_15channels.cfg")
-        if not os.path.exists(img_geometry_dst):
-            with open(img_geometry_src, 'r') as src, open(img_geometry_dst, 'w') as dst:
-                dst.write(src.read())
-            logger.debug("Copied image geometry config to {0}".format(img_geometry_dst))
-    except Exception as e:
-        logger.error("Error copying config files: {0}".format(str(e)))
+        os.makedirs(BUILD_CFG_DIR, exist_ok=True)
+        link_config_file(HAND_GEOMETRY_SRC, HAND_GEOMETRY_DST)
+        link_config_file(IMAGE_GEOMETRY_SRC, IMAGE_GEOMETRY_DST)
+    except Exception:
+        logger.exception("Error copying config files")
+
+def check_gpd_files():
+    """Fail fast if the GPD binary or its configs are missing."""
+    required = [EXECUTABLE, CONFIG_FILE, HAND_GEOMETRY_DST, IMAGE_GEOMETRY_DST]
+    missing = [path for path in required if not os.path.exists(path)]
+    if missing:
+        raise RuntimeError("Missing GPD files: {0}".format(", ".join(missing)))
+
+# The configs never change while the server runs, so set them up and check
+# them once on import instead of on every request
+copy_config_files()
+check_gpd_files()
+
+if CPU_SET:
+    logger.info("Pinning server and GPD workers to CPUs %s", sorted(CPU_SET))
+    os.sched_setaffinity(0, CPU_SET)
 
-def parse_gpd_output(stdout_text):
-    """Parse the text output from GPD into a structured format."""
-    # Initialize result structures
-    tf_matrices = []
-    widths = []
+# Start the GPD workers on import so requests don't pay for process startup.
+# Serve from a single process (gunicorn -w 1 -k gthread) so that all request
+# threads share this pool; a second process would start a second pool.
+logger.info("Starting %s GPD workers", NUM_WORKERS)
+pool = WorkerPool(NUM_WORKERS)
+atexit.register(pool.close)
+
+# Asynchronous jobs (POST /detect_grasps with async=true). Results are kept
+# until fetched; past MAX_JOBS, the oldest finished jobs are dropped. At most
+# MAX_PENDING_JOBS may be queued or running, each holding a link to its upload
+# in TEMP_DIR; further async requests get a 503, like sync ones when the pool
+# stays busy.
+MAX_JOBS = int(os.environ.get("GPD_MAX_JOBS", "1000"))
+MAX_PENDING_JOBS = int(os.environ.get("GPD_MAX_PENDING_JOBS", str(4 * NUM_WORKERS)))
+job_executor = ThreadPoolExecutor(max_workers=NUM_WORKERS)
+jobs = OrderedDict()
+jobs_lock = threading.Lock()
+
+def run_detection_job(pcd_path):
+    """Run detection for an asynchronous job, then remove its copy of the cloud."""
+    try:
+        return parse_gpd_output(pool.detect(pcd_path))
+    finally:
+        os.unlink(pcd_path)
+
+def submit_detection_job(temp_path):
+    """Queue detection on an uploaded cloud and return the new job's id.
+
+    Raises PoolBusyError if MAX_PENDING_JOBS jobs are already queued or running.
+    """
+    job_id = uuid.uuid4().hex
+    # The upload is deleted with the request, so keep a hard link to it for the job
+    job_path = os.path.join(os.path.dirname(temp_path), "job_{0}.pcd".format(job_id))
+    with jobs_lock:
+        pending = sum(1 for future in jobs.values() if not future.done())
+        if pending >= MAX_PENDING_JOBS:
+            raise PoolBusyError("{0} detection jobs are already pending".format(pending))
+        os.link(temp_path, job_path)
+        # Forget the oldest finished jobs once the table is full
+        for old_id in [i for i, f in jobs.items() if f.done()]:
+            if len(jobs) < MAX_JOBS:
+                break
+            del jobs[old_id]
+        jobs[job_id] = job_executor.submit(run_detection_job, job_path)
+    return job_id
+
+# Environment clouds uploaded once (POST /upload_env) and merged into later
+# detection requests that name them with env_id. Only the MAX_ENVS most
+# recently used ones are kept, and only as many as fit in MAX_ENV_BYTES of
+# point data together; a larger single cloud is rejected.
+MAX_ENVS = int(os.environ.get("GPD_MAX_ENVS", "16"))
+MAX_ENV_BYTES = int(os.environ.get("GPD_MAX_ENV_MB", "1024")) * 1024 * 1024
+envs = OrderedDict()
+envs_bytes = 0
+envs_lock = threading.Lock()
+PCD_XYZ_HEADER = (
+    b"# .PCD v0.7 - Point Cloud Data file format\n"
+    b"VERSION 0.7\n"
+    b"FIELDS x y z\n"
+    b"SIZE 4 4 4\n"
+    b"TYPE F F F\n"
+    b"COUNT 1 1 1\n"
+    b"WIDTH %d\n"
+    b"HEIGHT 1\n"
+    b"VIEWPOINT 0 0 0 1 0 0 0\n"
+    b"POINTS %d\n"
+    b"DATA binary\n"
+)
+PCD_XYZ_POINT_SIZE = 12
+
+def read_xyz_pcd(stream):
+    """Read the point data of a binary PCD file with only float32 x, y, z fields.
+
+    Returns None if the file has any other layout.
+    """
+    stream.seek(0)
+    header = {}
+    while True:
+        line = stream.readline()
+        if not line:
+            return None
+        words = line.split()
+        if not words or words[0].startswith(b"#"):
+            continue
+        header[words[0]] = words[1:]
+        if words[0] == b"DATA":
+            break
+    if (header.get(b"DATA") != [b"binary"]
+            or header.get(b"FIELDS") != [b"x", b"y", b"z"]
+            or header.get(b"SIZE") != [b"4"] * 3
+            or header.get(b"TYPE") != [b"F"] * 3
+            or header.get(b"COUNT", [b"1"] * 3) != [b"1"] * 3):
+        return None
+    size = int(header.get(b"POINTS", [b"0"])[0]) * PCD_XYZ_POINT_SIZE
+    points = stream.read(size)
+    return points if len(points) == size else None
+
+def merge_env_points(stream, env_points):
+    """Append stored environment points to the uploaded cloud in `stream`.
+
+    Returns False if the upload isn't a binary float32 x, y, z PCD file.
+    """
+    points = read_xyz_pcd(stream)
+    if points is None:
+        return False
+    num_points = (len(points) + len(env_points)) // PCD_XYZ_POINT_SIZE
+    stream.seek(0)
+    stream.write(PCD_XYZ_HEADER % (num_points, num_points))
+    stream.write(points)
+    stream.write(env_points)
+    stream.truncate()
+    stream.flush()
+    return True
+
+NPZ_MIMETYPE = 'application/x-npz'
+
+def json_response(payload, status=200):
+    """Serialize `payload` once, compactly, into a JSON response."""
+    body = json.dumps(payload, separators=(',', ':'))
+    return Response(body, status=status, mimetype='application/json')
+
+def grasp_response(result):
+    """Send parsed grasps as JSON, or as an .npz archive to clients that ask for it.
+
+    The binary form spares both sides building and walking nested JSON lists
+    of matrices; clients opt in with "Accept: application/x-npz".
+    """
+    if request.accept_mimetypes.best_match(['application/json', NPZ_MIMETYPE]) == NPZ_MIMETYPE:
+        buffer = io.BytesIO()
+        np.savez(buffer, **result)
+        return Response(buffer.getvalue(), mimetype=NPZ_MIMETYPE)
+    return json_response({key: value.tolist() for key, value in result.items()})
+
+def parse_gpd_output(stdout):
+    """Parse the raw (bytes) output from GPD into arrays of grasp poses, widths and scores."""
+    grasp_nums = []
     scores = []
     
-    # Look for grasp information in the output
-    lines = stdout_text.strip().split('\n')
-    in_selected_grasps = False
+    # Only the selected grasps section holds grasp information. Workers already
+    # cut their output down to it, but the banners are still honored here.
+    start = stdout.find(SELECTED_GRASPS_BANNER)
+    if start != -1:
+        end = stdout.find(RUNTIMES_BANNER, start)
+        if end == -1:
+            end = len(stdout)
+        for match in GRASP_LINE_PATTERN.finditer(stdout, start, end):
+            try:
+                score = float(match.group(2))
+            except ValueError:
+                continue
+            grasp_nums.append(int(match.group(1)))
+            scores.append(score)
     
-    for line in lines:
-        line = line.strip()
-        
-        # Identify the selected grasps section
-        if "======== Selected grasps ========" in line:
-            in_selected_grasps = True
-            continue
-            
-        # End of grasps section
-        if in_selected_grasps and "======== RUNTIMES ========" in line:
-            break
-            
-        # Parse grasp scores
-        if in_selected_grasps and line.startswith("Grasp "):
-            parts = line.split(":")
-            if len(parts) == 2:
-                try:
-                    grasp_num = int(parts[0].replace("Grasp ", "").strip())
-                    score = float(parts[1].strip())
-                    scores.append(score)
-                    
-                    # Create a transform matrix with a slight offset to differentiate grasps
-                    # Rotation matrix is identity, position has small offsets
-                    x_offset = 0.01 * (grasp_num % 3)
-                    y_offset = 0.01 * (grasp_num // 3)
-                    tf_matrix = [
-                        [1.0, 0.0, 0.0, x_offset],
-                        [0.0, 1.0, 0.0, y_offset],
-                        [0.0, 0.0, 1.0, 0.1],
-                        [0.0, 0.0, 0.0, 1.0]
-                    ]
-                    tf_matrices.append(tf_matrix)
-                    
-                    # Estimate a reasonable width based on score
-                    # Just a placeholder - you'd ideally get this from GPD
-                    width = 0.05 + 0.03 * (score / 1000.0)  # Scale width based on score
-                    widths.append(width)
-                except ValueError:
-                    pass
+    grasp_nums = np.array(grasp_nums, dtype=np.int64)
+    scores = np.array(scores, dtype=np.float64)
+    
+    # Create transform matrices with a slight offset to differentiate grasps
+    # Rotation matrix is identity, position has small offsets
+    tf_matrices = np.tile(np.eye(4), (len(grasp_nums), 1, 1))
+    tf_matrices[:, 0, 3] = 0.01 * (grasp_nums % 3)
+    tf_matrices[:, 1, 3] = 0.01 * (grasp_nums // 3)
+    tf_matrices[:, 2, 3] = 0.1
+    
+    # Estimate a reasonable width based on score
+    # Just a placeholder - you'd ideally get this from GPD
+    widths = 0.05 + 0.03 * (scores / 1000.0)
     
     return {
         "tf_matrices": tf_matrices,
@@ -112,107 +494,167 @@ def parse_gpd_output(stdout_text):
 @app.route('/detect_grasps', methods=['POST'])
 def detect_grasps():
     """API endpoint to detect grasps in a point cloud."""
-    logger.info("Received grasp detection request")
+    # Correlation id that ties error responses to the server log
+    request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex[:12]
+    logger.info("Received grasp detection request %s", request_id)
     
     # Check if a file was uploaded
     if 'point_cloud' not in request.files:
         logger.error("No point cloud file received")
-        return jsonify({"error": "No point cloud file provided"}), 400
+        return json_response({"error": "No point cloud file provided"}, 400)
     
     file = request.files['point_cloud']
-    logger.info("Received point cloud file: {0}".format(file.filename))
+    logger.info("Received point cloud file: %s", file.filename)
     
     # Get parameters from request
     visualization = request.form.get('visualization', 'false').lower() == 'true'
-    logger.info("Visualization enabled: {0}".format(visualization))
+    logger.info("Visualization enabled: %s", visualization)
     
     rotation_resolution = request.form.get('rotation_resolution', '8')
     top_n = request.form.get('top_n', '5')
     n_best = request.form.get('n_best', '1')
     
-    # Save the file to a temporary location
-    temp_file = tempfile.NamedTemporaryFile(prefix='input_cloud_', suffix='.pcd', delete=False)
-    temp_path = temp_file.name
-    temp_file.close()
-    
     try:
-        # Save the uploaded file
-        file_content = file.read()
-        with open(temp_path, 'wb') as f:
-            f.write(file_content)
-        logger.debug("Point cloud saved to temporary file: {0}".format(temp_path))
-        logger.debug("File saved successfully. Size: {0} bytes".format(len(file_content)))
+        # The upload was streamed straight into a temporary PCD file (see GpdRequest)
+        file.stream.flush()
+        temp_path = file.stream.name
+        # The request body size is already known; no need to stat the file we just wrote
+        logger.debug("Point cloud saved to temporary file: %s (request size: %s bytes)",
+                     temp_path, request.content_length)
+        
+        # Merge in an environment cloud uploaded earlier, if one is named
+        env_id = request.form.get('env_id')
+        if env_id:
+            with envs_lock:
+                env_points = envs.get(env_id)
+                if env_points is not None:
+                    envs.move_to_end(env_id)
+            if env_points is None:
+                return json_response({"error": "Unknown env_id", "env_id": env_id}, 404)
+            if not merge_env_points(file.stream, env_points):
+                return json_response({"error": "Clouds sent with env_id must be binary PCD "
+                                               "files with float32 x, y, z fields"}, 400)
+        
+        if request.form.get('async', 'false').lower() == 'true':
+            try:
+                job_id = submit_detection_job(temp_path)
+            except PoolBusyError as e:
+                logger.warning("Rejecting request: %s", e)
+                return json_response({"error": "Server busy, try again later"}, 503)
+            logger.info("Queued request %s as job %s", request_id, job_id)
+            return json_response({"job_id": job_id, "status": "pending"}, 202)
         
         # Prepare GPD command
-        logger.debug("Parameters: rotation_resolution={0}, top_n={1}, n_best={2}".format(
-            rotation_resolution, top_n, n_best))
-        command = [
-            os.path.join(WORKING_DIR, "detect_grasps"),
-            CONFIG_FILE,
-            temp_path
-        ]
-        command_str = " ".join(command)
-        logger.info("Executing command: {0}".format(command_str))
+        logger.debug("Parameters: rotation_resolution=%s, top_n=%s, n_best=%s",
+                     rotation_resolution, top_n, n_best)
+        logger.info("Running detection on %s with %s", temp_path, EXECUTABLE)
         
-        # Run GPD detection
-        logger.debug("Starting subprocess")
-        logger.info("Running command in directory: {0}".format(WORKING_DIR))
+        # Run GPD detection on one of the persistent workers
         logger.info("Starting grasp detection process...")
         start_time = time.time()
         
-        # In Python 3.5, text parameter isn't available, so we handle it differently
-        process = subprocess.Popen(
-            command, 
-            stdout=subprocess.PIPE, 
-            stderr=subprocess.PIPE,
-            cwd=WORKING_DIR
-        )
-        stdout_bytes, stderr_bytes = process.communicate()
-        stdout = stdout_bytes.decode('utf-8')
-        stderr = stderr_bytes.decode('utf-8')
+        try:
+            stdout = pool.detect(temp_path, timeout=QUEUE_TIMEOUT)
+        except PoolBusyError as e:
+            logger.warning("Rejecting request: %s", e)
+            return json_response({"error": "Server busy, try again later"}, 503)
+        except (DetectionError, WorkerError) as e:
+            logger.error("Grasp detection failed for request %s: %s", request_id, e)
+            return json_response({"error": "Grasp detection failed", "details": str(e),
+                                  "request_id": request_id}, 500)
         
         execution_time = time.time() - start_time
-        logger.info("Process completed in {0:.2f} seconds".format(execution_time))
-        
-        # Log output
-        logger.debug("Command stdout: {0}".format(stdout))
-        if stderr:
-            logger.warning("Command stderr: {0}".format(stderr))
-        
-        if process.returncode != 0:
-            logger.error("Command failed with exit code {0}".format(process.returncode))
-            return jsonify({"error": "Grasp detection failed", "details": stderr}), 500
+        logger.info("Process completed in %.2f seconds", execution_time)
         
         # Parse the GPD output
         try:
             result = parse_gpd_output(stdout)
-            return jsonify(result)
+            return grasp_response(result)
         except Exception as e:
-            logger.error("JSON decode error: {0}".format(str(e)))
-            logger.error("Raw output: {0}".format(stdout))
-            return jsonify({"error": "Failed to parse GPD output"}), 500
+            logger.error("Failed to parse GPD output for request %s: %s: %s",
+                         request_id, type(e).__name__, e, exc_info=True)
+            logger.error("Raw output: %s", stdout.decode('utf-8', 'replace'))
+            return json_response({"error": "Failed to parse GPD output",
+                                  "type": type(e).__name__,
+                                  "request_id": request_id}, 500)
             
     except Exception as e:
-        logger.error("Error during grasp detection: {0}".format(str(e)))
-        return jsonify({"error": str(e)}), 500
-    finally:
-        # Clean up temporary file
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
-            logger.debug("Removed temporary file: {0}".format(temp_path))
+        # Unexpected errors only: the expected ones (busy pool, failed detection,
+        # broken worker) are answered above without a traceback
+        logger.error("Error during grasp detection for request %s: %s: %s",
+                     request_id, type(e).__name__, e, exc_info=True)
+        return json_response({"error": str(e), "type": type(e).__name__,
+                              "request_id": request_id}, 500)
+
+@app.route('/detect_grasps/<job_id>', methods=['GET'])
+def detection_job_status(job_id):
+    """Return the result of an asynchronous detection job, or 202 while it runs.
+    
+    A finished job's result can be fetched once.
+    """
+    with jobs_lock:
+        future = jobs.get(job_id)
+        if future is None:
+            return json_response({"error": "Unknown job", "job_id": job_id}, 404)
+        if not future.done():
+            return json_response({"job_id": job_id, "status": "pending"}, 202)
+        del jobs[job_id]
+    
+    try:
+        result = future.result()
+    except (DetectionError, WorkerError) as e:
+        logger.error("Grasp detection failed for job %s: %s", job_id, e)
+        return json_response({"error": "Grasp detection failed", "details": str(e),
+                              "job_id": job_id}, 500)
+    except Exception as e:
+        logger.error("Error during grasp detection for job %s: %s: %s",
+                     job_id, type(e).__name__, e, exc_info=True)
+        return json_response({"error": str(e), "type": type(e).__name__,
+                              "job_id": job_id}, 500)
+    return grasp_response(result)
+
+@app.route('/upload_env', methods=['POST'])
+def upload_env():
+    """Store an environment cloud for later detection requests and return its id.
+
+    Requests to /detect_grasps that pass the id as env_id only need to upload
+    the item cloud; the stored points are appended to it.
+    """
+    if 'point_cloud' not in request.files:
+        return json_response({"error": "No point cloud file provided"}, 400)
+    points = read_xyz_pcd(request.files['point_cloud'].stream)
+    if points is None:
+        return json_response({"error": "Environment clouds must be binary PCD files "
+                                       "with float32 x, y, z fields"}, 400)
+    
+    if len(points) > MAX_ENV_BYTES:
+        return json_response({"error": "Environment cloud exceeds the server's limit of "
+                                       "{0} bytes".format(MAX_ENV_BYTES)}, 413)
+    
+    global envs_bytes
+    env_id = hashlib.sha1(points).hexdigest()
+    with envs_lock:
+        old_points = envs.pop(env_id, None)
+        if old_points is not None:
+            envs_bytes -= len(old_points)
+        envs[env_id] = points
+        envs_bytes += len(points)
+        # Drop the least recently used clouds past the count or size limit
+        while len(envs) > MAX_ENVS or envs_bytes > MAX_ENV_BYTES:
+            envs_bytes -= len(envs.popitem(last=False)[1])
+    logger.info("Stored environment cloud %s (%s points)", env_id, len(points) // PCD_XYZ_POINT_SIZE)
+    return json_response({"env_id": env_id})
 
 @app.route('/health', methods=['GET'])
 def health_check():
     """Simple health check endpoint."""
-    return jsonify({"status": "healthy"})
+    return json_response({"status": "healthy"})
 
 if __name__ == '__main__':
-    # Copy required config files first
-    copy_config_files()
-    
+    # Development server; see the Dockerfile for the gunicorn command line
     # Log info
-    logger.info("Config file path: {0}".format(CONFIG_FILE))
+    logger.info("Config file path: %s", CONFIG_FILE)
     logger.info("Starting Flask server on port 5000")
     
-    # Start Flask server
-    app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
+    # Start Flask server; each request waits on a worker in its own thread
+    app.run(host='0.0.0.0', port=5000, threaded=True)
\ No newline at end of file
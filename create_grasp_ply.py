@@ -7,67 +7,178 @@ This script loads grasp data and creates explicit 3D models of grippers at each
 import open3d as o3d
 import numpy as np
 import os
-import copy
 import matplotlib.pyplot as plt
 
-def create_gripper_mesh(transform_matrix, width, score, score_min, score_max):
-    """Create a gripper mesh at the given pose with the given width."""
-    # Create a more visible gripper representation
-    
-    # Base dimensions
-    base_width = 0.03
-    base_height = 0.015
-    base_depth = 0.03
-    
-    # Finger dimensions
-    finger_width = 0.01
-    finger_height = 0.04
-    finger_depth = 0.02
-    
-    # Create base
-    base = o3d.geometry.TriangleMesh.create_box(
-        width=base_width, 
-        height=base_height, 
-        depth=base_depth
-    )
-    base.translate([-base_width/2, -base_height/2, -base_depth/2])
+# Gripper dimensions (meters)
+BASE_WIDTH = 0.03
+BASE_HEIGHT = 0.015
+BASE_DEPTH = 0.03
+FINGER_WIDTH = 0.01
+FINGER_HEIGHT = 0.04
+FINGER_DEPTH = 0.02
+
+# RGB entries of the jet colormap, looked up directly when coloring grasps
+JET_LUT = plt.cm.jet(np.arange(plt.cm.jet.N))[:, :3]
+
+# PLY property types as little-endian NumPy types
+PLY_TYPES = {
+    b'char': 'i1', b'int8': 'i1', b'uchar': 'u1', b'uint8': 'u1',
+    b'short': '<i2', b'int16': '<i2', b'ushort': '<u2', b'uint16': '<u2',
+    b'int': '<i4', b'int32': '<i4', b'uint': '<u4', b'uint32': '<u4',
+    b'float': '<f4', b'float32': '<f4', b'double': '<f8', b'float64': '<f8'
+}
+
+def read_ply_vertices(path):
+    """Memory-map the vertices of a binary little-endian PLY file.
+    
+    Returns a structured array with one field per vertex property, or None if
+    the file needs a full parser (ASCII/big-endian data, list properties or
+    elements stored before the vertices).
+    """
+    with open(path, 'rb') as f:
+        if f.readline().strip() != b'ply':
+            return None
+        data_format = None
+        vertex_count = None
+        fields = []
+        element = None
+        for line in f:
+            words = line.split()
+            if not words:
+                continue
+            if words[0] == b'end_header':
+                break
+            if words[0] == b'format':
+                data_format = words[1]
+            elif words[0] == b'element':
+                element = words[1]
+                if element == b'vertex':
+                    vertex_count = int(words[2])
+                elif vertex_count is None:
+                    return None
+            elif words[0] == b'property' and element == b'vertex':
+                if words[1] not in PLY_TYPES:
+                    return None
+                fields.append((words[2].decode('ascii'), PLY_TYPES[words[1]]))
+        else:
+            return None
+        data_offset = f.tell()
+    
+    if data_format != b'binary_little_endian' or not vertex_count or not fields:
+        return None
+    return np.memmap(path, dtype=np.dtype(fields), mode='r',
+                     offset=data_offset, shape=(vertex_count,))
+
+def read_point_cloud(path):
+    """Read a point cloud, mapping binary PLY files instead of parsing them.
+    
+    Other formats go through Open3D's reader.
+    """
+    vertices = read_ply_vertices(path)
+    if vertices is None or not all(axis in vertices.dtype.names for axis in 'xyz'):
+        return o3d.io.read_point_cloud(path)
+    
+    def stack(names, scale=1.0):
+        # Copy the fields straight into the float64 array Open3D needs
+        values = np.empty((len(vertices), len(names)))
+        for i, name in enumerate(names):
+            values[:, i] = vertices[name]
+        values *= scale
+        return o3d.utility.Vector3dVector(values)
     
-    # Create fingers
-    left_finger = o3d.geometry.TriangleMesh.create_box(
-        width=finger_width, 
-        height=finger_height, 
-        depth=finger_depth
+    cloud = o3d.geometry.PointCloud()
+    cloud.points = stack(('x', 'y', 'z'))
+    if all(name in vertices.dtype.names for name in ('nx', 'ny', 'nz')):
+        cloud.normals = stack(('nx', 'ny', 'nz'))
+    if all(name in vertices.dtype.names for name in ('red', 'green', 'blue')):
+        # Open3D stores colors as floats in [0, 1]
+        color_type = vertices.dtype['red']
+        scale = 1.0 / np.iinfo(color_type).max if color_type.kind in 'ui' else 1.0
+        cloud.colors = stack(('red', 'green', 'blue'), scale)
+    
+    return cloud
+
+def create_box(width, height, depth, offset):
+    """Create a box mesh translated by `offset`."""
+    box = o3d.geometry.TriangleMesh.create_box(width=width, height=height, depth=depth)
+    box.translate(offset)
+    return box
+
+def create_gripper_boxes():
+    """Create the canonical gripper base and finger boxes.
+    
+    The finger is centered on the gripper's x-axis; each grasp moves a copy of it
+    out to either side by half the grasp width.
+    """
+    base = create_box(
+        BASE_WIDTH, BASE_HEIGHT, BASE_DEPTH,
+        [-BASE_WIDTH/2, -BASE_HEIGHT/2, -BASE_DEPTH/2]
     )
-    right_finger = o3d.geometry.TriangleMesh.create_box(
-        width=finger_width, 
-        height=finger_height, 
-        depth=finger_depth
+    finger = create_box(
+        FINGER_WIDTH, FINGER_HEIGHT, FINGER_DEPTH,
+        [-FINGER_WIDTH/2, 0, -FINGER_DEPTH/2]
     )
+    return base, finger
+
+def place_grippers(base_points, finger_points, tf_matrices, widths):
+    """Place canonical base/finger points at every grasp pose.
     
-    # Position fingers at correct width
-    left_finger.translate([-width/2 - finger_width/2, 0, -finger_depth/2])
-    right_finger.translate([width/2 - finger_width/2, 0, -finger_depth/2])
+    Returns an (N, P, 3) array holding the base, left finger and right finger
+    points of each of the N grippers.
+    """
+    tf_matrices = np.asarray(tf_matrices, dtype=np.float64).reshape(-1, 4, 4)
+    widths = np.asarray(widths, dtype=np.float64)
+    num_grasps = len(tf_matrices)
     
-    # Combine into a single mesh
-    gripper = base
-    gripper += left_finger
-    gripper += right_finger
+    # Move the fingers out to each grasp's width
+    finger_offsets = np.zeros((num_grasps, 1, 3))
+    finger_offsets[:, 0, 0] = widths / 2
+    local_points = np.concatenate([
+        np.broadcast_to(base_points, (num_grasps,) + base_points.shape),
+        finger_points - finger_offsets,
+        finger_points + finger_offsets
+    ], axis=1)
     
-    # Color based on score (red for highest score, blue for lowest)
+    # Transform all grippers to their poses at once
+    rotations = tf_matrices[:, :3, :3]
+    translations = tf_matrices[:, :3, 3]
+    return local_points @ rotations.transpose(0, 2, 1) + translations[:, None, :]
+
+def score_colors(scores):
+    """Color scores with the jet colormap (red for highest score, blue for lowest)."""
+    scores = np.asarray(scores, dtype=np.float64)
+    score_min = scores.min() if len(scores) else 0.0
+    score_max = scores.max() if len(scores) else 0.0
     score_range = score_max - score_min if score_max > score_min else 1.0
-    norm_score = (score - score_min) / score_range
+    # Same binning as calling the colormap with floats
+    indices = ((scores - score_min) / score_range * len(JET_LUT)).astype(np.int64)
+    return JET_LUT[np.clip(indices, 0, len(JET_LUT) - 1)]
+
+def create_gripper_points(tf_matrices, widths, scores, points_per_gripper=500):
+    """Create a point cloud sampled from a gripper at every grasp pose, colored by score.
+    
+    The canonical gripper surface is sampled once and the samples are moved to
+    each pose, instead of sampling every gripper mesh separately.
+    """
+    base, finger = create_gripper_boxes()
     
-    # Use colormap for coloring (red to blue)
-    cmap = plt.cm.jet
-    color = cmap(norm_score)[:3]  # Get RGB from colormap
+    # Split the samples between the boxes by surface area
+    base_area = base.get_surface_area()
+    finger_area = finger.get_surface_area()
+    finger_count = int(round(points_per_gripper * finger_area / (base_area + 2 * finger_area)))
+    base_count = points_per_gripper - 2 * finger_count
+    base_points = np.asarray(base.sample_points_uniformly(number_of_points=base_count).points)
+    finger_points = np.asarray(finger.sample_points_uniformly(number_of_points=finger_count).points)
     
-    # Apply color
-    gripper.paint_uniform_color(color)
+    points = place_grippers(base_points, finger_points, tf_matrices, widths)
     
-    # Transform to correct pose
-    gripper.transform(transform_matrix)
+    grippers = o3d.geometry.PointCloud()
+    grippers.points = o3d.utility.Vector3dVector(points.reshape(-1, 3))
+    grippers.colors = o3d.utility.Vector3dVector(
+        np.repeat(score_colors(scores), points.shape[1], axis=0)
+    )
     
-    return gripper
+    return grippers
 
 def create_grasp_visualization_ply():
     """Create a PLY file with visible representations of the grasps."""
@@ -81,8 +192,8 @@ def create_grasp_visualization_ply():
         print(f"Error: Point cloud files not found: {item_cloud_path} or {env_cloud_path}")
         return False
     
-    item_cloud = o3d.io.read_point_cloud(item_cloud_path)
-    env_cloud = o3d.io.read_point_cloud(env_cloud_path)
+    item_cloud = read_point_cloud(item_cloud_path)
+    env_cloud = read_point_cloud(env_cloud_path)
     
     print("Getting grasp data...")
     
@@ -106,40 +217,29 @@ def create_grasp_visualization_ply():
         
         print(f"Found {len(scores)} grasps")
         
-        # Get score range for coloring
-        score_min = min(scores)
-        score_max = max(scores)
-        
-        # Create a new point cloud for the scene
-        scene_cloud = copy.deepcopy(env_cloud)
-        scene_cloud += item_cloud
-        
-        # Create visible 3D gripper models for each grasp
-        gripper_meshes = []
-        for i, (transform, width, score) in enumerate(zip(tf_matrices, widths, scores)):
-            print(f"Creating gripper model for grasp {i+1} (score: {score}, width: {width})")
-            
-            # Create a gripper mesh
-            gripper = create_gripper_mesh(transform, width, score, score_min, score_max)
-            gripper_meshes.append(gripper)
+        # Create visible 3D gripper models for all grasps, as points sampled
+        # from the gripper surfaces for better visibility
+        print(f"Creating gripper models for {len(scores)} grasps")
+        gripper_points = create_gripper_points(tf_matrices, widths, scores, points_per_gripper=500)
         
         # Save scene with separate gripper models
         output_path = "grasp_visualized_grippers.ply"
         
-        # Convert gripper meshes to point clouds for better visibility
-        gripper_points = o3d.geometry.PointCloud()
-        for gripper_mesh in gripper_meshes:
-            # Sample points from the mesh surface
-            gripper_pc = gripper_mesh.sample_points_uniformly(number_of_points=500)
-            gripper_points += gripper_pc
-        
         # Make gripper points larger for better visibility
         # (This doesn't affect the PLY file, but shows the intent)
         print("Adding gripper visualizations to the scene")
         
-        # Combine with scene
-        visualization_cloud = copy.deepcopy(scene_cloud)
-        visualization_cloud += gripper_points
+        # Combine with scene, stacking all points once rather than deep-copying
+        # the (possibly large) scene clouds and merging them pairwise
+        clouds = [env_cloud, item_cloud, gripper_points]
+        visualization_cloud = o3d.geometry.PointCloud()
+        visualization_cloud.points = o3d.utility.Vector3dVector(
+            np.concatenate([np.asarray(cloud.points) for cloud in clouds])
+        )
+        if all(cloud.has_colors() for cloud in clouds):
+            visualization_cloud.colors = o3d.utility.Vector3dVector(
+                np.concatenate([np.asarray(cloud.colors) for cloud in clouds])
+            )
         
         # Save the combined visualization
         o3d.io.write_point_cloud(output_path, visualization_cloud)
@@ -4,38 +4,320 @@ Util functions for communicating with graspnet docker server.
 
 from __future__ import annotations
 
+import hashlib
+import io
 import os
-import tempfile
+import threading
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
 import numpy as np
 import open3d as o3d
 import requests
 import json
+import logging
 import matplotlib.pyplot as plt
 from typing import Any, Optional, Tuple, List
 
+try:
+    # Decodes the grasp JSON several times faster than the json module
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
+
+logger = logging.getLogger(__name__)
+
 # Constants
 # max gripper width is 0.175m, but in nn is 0.100m, therefore we scale models
 SCALE = 0.1 / 0.175
 MAX_GRIPPER_WIDTH = 0.07
 GRIPPER_HEIGHT = 0.24227 * SCALE
 
+# Shared HTTP session, so repeated grasp requests reuse a kept-alive connection
+# instead of opening a new one per call
+HTTP_SESSION = requests.Session()
+HTTP_SESSION.mount("http://", requests.adapters.HTTPAdapter(pool_connections=2, pool_maxsize=4, max_retries=0))
+
+# Header of a binary PCD file with float32 x, y, z fields (WIDTH and POINTS are
+# the number of points). GPD loads clouds with PCL, which maps these fields
+# straight onto its point type, so this is all the server needs.
+PCD_HEADER = (
+    b"# .PCD v0.7 - Point Cloud Data file format\n"
+    b"VERSION 0.7\n"
+    b"FIELDS x y z\n"
+    b"SIZE 4 4 4\n"
+    b"TYPE F F F\n"
+    b"COUNT 1 1 1\n"
+    b"WIDTH %d\n"
+    b"HEIGHT 1\n"
+    b"VIEWPOINT 0 0 0 1 0 0 0\n"
+    b"POINTS %d\n"
+    b"DATA binary\n"
+)
+
+def pcd_header(num_points: int) -> bytes:
+    """Return the PCD header for `num_points` float32 x, y, z points."""
+    return PCD_HEADER % (num_points, num_points)
+
+def pcd_points(points: np.ndarray) -> np.ndarray:
+    """Return points as the contiguous little-endian float32 data of a binary PCD."""
+    return np.ascontiguousarray(points, dtype="<f4").reshape(-1, 3)
+
+def encode_pcd(points: np.ndarray) -> bytes:
+    """
+    Encode points as a binary PCD file with float32 x, y, z fields.
+    
+    Parameters:
+        points: (N, 3) array of point coordinates
+        
+    Returns:
+        bytes: Contents of the PCD file
+    """
+    points = pcd_points(points)
+    return pcd_header(len(points)) + points.tobytes()
+
+class MultipartStream:
+    """
+    File-like multipart/form-data body that is read straight from its parts.
+    
+    requests sends objects with read() and a length without buffering them, so
+    file parts (e.g. a PCD header and the point array) go to the socket in
+    small blocks instead of through one joined copy of the whole body. The
+    length is known up front, so no chunked transfer encoding is needed.
+    """
+    
+    def __init__(self, fields: dict, files: dict):
+        """
+        Parameters:
+            fields: Form field names and values
+            files: Form field names mapped to (filename, chunks, content_type),
+                where chunks are bytes-like objects (e.g. bytes or arrays)
+        """
+        boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/form-data; boundary={boundary}"
+        
+        parts = []
+        for name, value in fields.items():
+            parts.append((
+                f"--{boundary}\r\n"
+                f'Content-Disposition: form-data; name="{name}"\r\n\r\n'
+                f"{value}\r\n"
+            ).encode("utf-8"))
+        for name, (filename, chunks, content_type) in files.items():
+            parts.append((
+                f"--{boundary}\r\n"
+                f'Content-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                f"Content-Type: {content_type}\r\n\r\n"
+            ).encode("utf-8"))
+            parts.extend(memoryview(chunk).cast("B") for chunk in chunks)
+            parts.append(b"\r\n")
+        parts.append(f"--{boundary}--\r\n".encode("utf-8"))
+        
+        self._parts = [memoryview(part) for part in parts]
+        self._length = sum(len(part) for part in self._parts)
+        self._index = 0
+        self._offset = 0
+    
+    def __len__(self) -> int:
+        return self._length
+    
+    def read(self, size: int = -1) -> bytes | memoryview:
+        """Read up to `size` bytes; blocks within one part are returned without a copy."""
+        if size is None or size < 0:
+            size = self._length
+        chunks = []
+        while size > 0 and self._index < len(self._parts):
+            part = self._parts[self._index]
+            chunk = part[self._offset:self._offset + size]
+            chunks.append(chunk)
+            size -= len(chunk)
+            self._offset += len(chunk)
+            if self._offset == len(part):
+                self._index += 1
+                self._offset = 0
+        if len(chunks) == 1:
+            return chunks[0]
+        return b"".join(chunks)
+
+def post_point_cloud(
+    url: str,
+    point_arrays: List[np.ndarray],
+    params: dict,
+    timeout: int,
+    headers: Optional[dict] = None
+) -> requests.Response:
+    """
+    POST points as one PCD file (the arrays one after the other) with form parameters.
+    
+    The body is streamed from the arrays, see MultipartStream.
+    """
+    num_points = sum(len(points) for points in point_arrays)
+    body = MultipartStream(params, {
+        "point_cloud": ("cloud.pcd", [pcd_header(num_points)] + point_arrays, "application/octet-stream")
+    })
+    headers = dict(headers or {}, **{"Content-Type": body.content_type})
+    return HTTP_SESSION.post(url, data=body, headers=headers, timeout=timeout)
+
+# Ask for grasps as an .npz archive of arrays; older servers still answer with JSON
+GRASP_HEADERS = {"Accept": "application/x-npz, application/json;q=0.9"}
+
+# Server-side ids of uploaded environment clouds, as futures by (server URL,
+# content hash), so concurrent requests in a new environment upload it only
+# once. The lock only guards the dict; uploads run outside of it.
+ENV_IDS: dict = {}
+ENV_IDS_LOCK = threading.Lock()
+# Servers without an upload endpoint, which are sent the full cloud right away
+ENV_UPLOAD_UNSUPPORTED: set = set()
+
+def env_key(server_url: str, env_pcd_points: np.ndarray) -> Tuple[str, str]:
+    """Return the ENV_IDS key of environment points for a server."""
+    return server_url, hashlib.blake2b(env_pcd_points, digest_size=16).hexdigest()
+
+def upload_env(server_url: str, env_pcd_points: np.ndarray, timeout: int) -> Optional[str]:
+    """
+    Upload environment points once per server and return the server's id for them.
+    
+    Parameters:
+        server_url: URL of the server's detect_grasps endpoint
+        env_pcd_points: Environment points as returned by pcd_points
+        timeout: Request timeout in seconds
+        
+    Returns:
+        str: The environment id, or None if the server doesn't support uploads
+    """
+    key = env_key(server_url, env_pcd_points)
+    with ENV_IDS_LOCK:
+        if server_url in ENV_UPLOAD_UNSUPPORTED:
+            return None
+        env_future = ENV_IDS.get(key)
+        uploading = env_future is None
+        if uploading:
+            env_future = ENV_IDS[key] = Future()
+    if not uploading:
+        # Another request uploads (or uploaded) this environment
+        return env_future.result()
+    
+    try:
+        # The upload endpoint sits next to detect_grasps
+        upload_url = server_url.rsplit("/", 1)[0] + "/upload_env"
+        response = post_point_cloud(upload_url, [env_pcd_points], {}, timeout)
+        if response.status_code == 404:
+            env_id = None
+        else:
+            response.raise_for_status()
+            env_id = response.json()["env_id"]
+    except BaseException as e:
+        # Let the next request try again
+        with ENV_IDS_LOCK:
+            ENV_IDS.pop(key, None)
+        env_future.set_exception(e)
+        raise
+    
+    if env_id is None:
+        with ENV_IDS_LOCK:
+            ENV_UPLOAD_UNSUPPORTED.add(server_url)
+            ENV_IDS.pop(key, None)
+    env_future.set_result(env_id)
+    return env_id
+
+def request_grasps(
+    server_url: str,
+    item_points: np.ndarray,
+    env_points: np.ndarray,
+    rotation_resolution: int = 24,
+    top_n: int = 3,
+    n_best: int = 1,
+    timeout: int = 90,
+    reuse_env: bool = False
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Send item and environment points to the GraspNet server and return its raw grasps.
+    
+    Parameters:
+        server_url: URL of the server's detect_grasps endpoint
+        item_points: (N, 3) array of item points
+        env_points: (M, 3) array of environment points
+        rotation_resolution: Number of rotations to consider
+        top_n: Number of top grasps to return
+        n_best: Number of best grasps to select
+        timeout: Request timeout in seconds
+        reuse_env: Upload the environment once and only send the item afterwards
+            (for several requests in the same environment)
+        
+    Returns:
+        tuple: (tf_matrices, widths, scores) as returned by the server
+    """
+    # Only xyz is sent, so the item and environment points go into the PCD data
+    # one after the other, without a merged Open3D cloud or array
+    item_pcd_points = pcd_points(item_points)
+    env_pcd_points = pcd_points(env_points)
+
+    # Prepare parameters
+    params = {
+        "rotation_resolution": str(rotation_resolution),
+        "top_n": str(top_n),
+        "n_best": str(n_best)
+    }
+
+    # Send the cloud via HTTP POST, streaming the points from the arrays
+    response = None
+    if reuse_env:
+        env_id = upload_env(server_url, env_pcd_points, timeout)
+        if env_id is not None:
+            response = post_point_cloud(server_url, [item_pcd_points], dict(params, env_id=env_id), timeout,
+                                        GRASP_HEADERS)
+            if response.status_code == 404:
+                # The server dropped the environment (or restarted), send it along
+                with ENV_IDS_LOCK:
+                    ENV_IDS.pop(env_key(server_url, env_pcd_points), None)
+                response = None
+    if response is None:
+        response = post_point_cloud(server_url, [item_pcd_points, env_pcd_points], params, timeout,
+                                    GRASP_HEADERS)
+
+    # Raise an error for bad status codes
+    response.raise_for_status()
+    
+    # Parse the response, loading arrays directly if the server sent an archive
+    if response.headers.get("Content-Type", "").startswith("application/x-npz"):
+        with np.load(io.BytesIO(response.content)) as archive:
+            result = dict(archive)
+    else:
+        result = json_loads(response.content)
+        # Debug: log raw server response (formatted only if enabled)
+        logger.debug("GraspNet server returned: %s", result)
+
+    # Convert result fields into numpy arrays of fixed types, without copying
+    # arrays that already have them
+    tf_matrices = np.asarray(result["tf_matrices"], dtype=np.float64).reshape(-1, 4, 4)
+    widths = np.asarray(result["widths"], dtype=np.float32)
+    scores = np.asarray(result["scores"], dtype=np.float32)
+    logger.debug("tf_matrices count=%d, widths count=%d, scores count=%d",
+                 len(tf_matrices), len(widths), len(scores))
+    
+    return tf_matrices, widths, scores
+
 def predict_full_grasp(
     item_cloud: o3d.geometry.PointCloud,
-    env_cloud: o3d.geometry.PointCloud,
+    env_cloud: o3d.geometry.PointCloud | np.ndarray,
     config: Optional[dict] = None,
     server_ip: str = "127.0.0.1",
     server_port: int = 5000,
     rotation_resolution: int = 24,
     top_n: int = 3,
     n_best: int = 1,
-    timeout: int = 90
+    timeout: int = 90,
+    env_voxel_size: Optional[float] = None,
+    reuse_env: bool = False
 ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
     """
     Merge the item and environment point clouds, then call the GraspNet server.
     
+    Points are uploaded as float32, which is what GPD works with.
+    
     Parameters:
         item_cloud: Point cloud of the item to grasp
-        env_cloud: Point cloud of the environment
+        env_cloud: Point cloud of the environment, or its points as an (N, 3)
+            array (e.g. from pcd_points, to share them between calls)
         config: Configuration dictionary (optional)
         server_ip: Server IP address
         server_port: Server port
@@ -43,6 +325,10 @@ def predict_full_grasp(
         top_n: Number of top grasps to return
         n_best: Number of best grasps to select
         timeout: Request timeout in seconds
+        env_voxel_size: Voxel size (m) to downsample the environment cloud to
+            before uploading it (optional, the item cloud is always sent as is)
+        reuse_env: Upload the environment once per server and only send the item
+            on later calls with the same environment
         
     Returns:
         tuple: (tf_matrices, widths, scores)
@@ -61,56 +347,39 @@ def predict_full_grasp(
     # Construct the server URL
     server_url = f"http://{server_ip}:{server_port}/detect_grasps"
     
-    # Merge the item and environment point clouds
-    merged_cloud = item_cloud + env_cloud
-    
-    # Get the bounding box of the item to calculate centroid for transform correction later
-    item_bbox = item_cloud.get_axis_aligned_bounding_box()
-    item_center = item_bbox.get_center()
-    print(f"DEBUG: Item center is at {item_center}")
-
-    # Save the merged cloud to a temporary file
-    temp_dir = tempfile.gettempdir()
-    file_path = os.path.join(temp_dir, "client_temp_cloud.pcd")
-    o3d.io.write_point_cloud(file_path, merged_cloud)
-
-    # Prepare parameters
-    params = {
-        "rotation_resolution": str(rotation_resolution),
-        "top_n": str(top_n),
-        "n_best": str(n_best)
-    }
-
-    # Send the file via HTTP POST
-    with open(file_path, "rb") as f:
-        files = {"point_cloud": f}
-        response = requests.post(server_url, files=files, data=params, timeout=timeout)
-
-    # Clean up temporary file
-    os.remove(file_path)
+    # Get the bounding box of the item to calculate centroid for transform correction
+    # later, from the point array that is needed for the upload anyway
+    item_points = np.asarray(item_cloud.points)
+    if len(item_points) > 0:
+        item_min = item_points.min(axis=0)
+        item_max = item_points.max(axis=0)
+    else:
+        item_min = item_max = np.zeros(3)
+    item_center = 0.5 * (item_min + item_max)
+    logger.debug("Item center is at %s", item_center)
 
-    # Raise an error for bad status codes
-    response.raise_for_status()
-    
-    # Parse the response
-    result = response.json()
-    # Debug: print raw server response and array lengths
-    print("DEBUG: GraspNet server returned:", result)
-    print(f"DEBUG: tf_matrices count={len(result.get('tf_matrices', []))}, widths count={len(result.get('widths', []))}, scores count={len(result.get('scores', []))}")
+    # The environment only serves as collision context, so it can be sent coarser
+    if isinstance(env_cloud, o3d.geometry.PointCloud):
+        if env_voxel_size:
+            env_cloud = env_cloud.voxel_down_sample(env_voxel_size)
+        env_points = np.asarray(env_cloud.points)
+    else:
+        env_points = env_cloud
     
-    # Convert result fields into numpy arrays
-    tf_matrices = np.array(result["tf_matrices"])
-    widths = np.array(result["widths"])
-    scores = np.array(result["scores"])
+    tf_matrices, widths, scores = request_grasps(
+        server_url,
+        item_points,
+        env_points,
+        rotation_resolution=rotation_resolution,
+        top_n=top_n,
+        n_best=n_best,
+        timeout=timeout,
+        reuse_env=reuse_env
+    )
     
     # Apply transformation to move grasp poses to the actual item location
     if len(tf_matrices) > 0:
-        print("Transforming grasp poses to item location...")
-        corrected_tf_matrices = []
-        item_bbox = item_cloud.get_axis_aligned_bounding_box()
-        item_size = item_bbox.get_extent()
-        item_min = item_bbox.min_bound
-        item_max = item_bbox.max_bound
+        logger.debug("Transforming grasp poses to item location...")
         
         # Calculate offsets for better surface positioning
         # For grasps on top of object: position slightly above the minimum height of the object
@@ -122,42 +391,67 @@ def predict_full_grasp(
         safe_min = item_min + np.array([safe_margin, safe_margin, 0])
         safe_max = item_max - np.array([safe_margin, safe_margin, 0])
         
-        for tf in tf_matrices:
-            # Create a copy of the transformation matrix
-            corrected_tf = tf.copy()
-            
-            # Get approach vector (Z-axis of gripper)
-            approach_vector = tf[:3, 2]
-            is_top_grasp = approach_vector[2] < -0.7  # Approaching from above
-            is_side_grasp = abs(approach_vector[0]) > 0.7 or abs(approach_vector[1]) > 0.7  # Side approach
-            
-            # Set X,Y coordinates to be within the safe grasp region
-            # Clamp X,Y coordinates to be within the item footprint plus a small margin
-            raw_x = item_center[0] + tf[0, 3]
-            raw_y = item_center[1] + tf[1, 3]
-            corrected_tf[0, 3] = np.clip(raw_x, safe_min[0], safe_max[0])
-            corrected_tf[1, 3] = np.clip(raw_y, safe_min[1], safe_max[1])
-            
-            # For Z coordinate, position differently based on approach direction
-            if is_top_grasp:
-                # For top grasps, position slightly above the top surface
-                corrected_tf[2, 3] = top_surface_height + 0.01  # 1cm above surface
-            elif is_side_grasp:
-                # For side grasps, position at the center height
-                corrected_tf[2, 3] = side_grasp_height
-            else:
-                # For other angles, use a middle-ground approach
-                corrected_tf[2, 3] = item_center[2]
-                
-            corrected_tf_matrices.append(corrected_tf)
+        # Classify all grasps by approach vector (Z-axis of gripper)
+        approach_vectors = tf_matrices[:, :3, 2]
+        is_top_grasp = approach_vectors[:, 2] < -0.7  # Approaching from above
+        is_side_grasp = (np.abs(approach_vectors[:, 0]) > 0.7) | (np.abs(approach_vectors[:, 1]) > 0.7)  # Side approach
+        
+        # Set X,Y coordinates to be within the safe grasp region
+        # Clamp X,Y coordinates to be within the item footprint plus a small margin
+        raw_xy = item_center[:2] + tf_matrices[:, :2, 3]
+        tf_matrices[:, :2, 3] = np.clip(raw_xy, safe_min[:2], safe_max[:2])
         
-        tf_matrices = np.array(corrected_tf_matrices)
-        print("Grasp poses transformed:")
-        for i, tf in enumerate(tf_matrices):
-            print(f"Grasp {i+1} position: [{tf[0,3]:.4f}, {tf[1,3]:.4f}, {tf[2,3]:.4f}]")
+        # For Z coordinate, position differently based on approach direction:
+        # slightly above the top surface for top grasps, at the center height for
+        # side grasps and at the item center for other angles
+        tf_matrices[:, 2, 3] = np.where(
+            is_top_grasp,
+            top_surface_height + 0.01,  # 1cm above surface
+            np.where(is_side_grasp, side_grasp_height, item_center[2])
+        )
+        
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Grasp poses transformed:")
+            for i, tf in enumerate(tf_matrices):
+                logger.debug("Grasp %d position: [%.4f, %.4f, %.4f]", i + 1, tf[0, 3], tf[1, 3], tf[2, 3])
 
     return tf_matrices, widths, scores
   
+def predict_many(
+    item_clouds: List[o3d.geometry.PointCloud],
+    env_cloud: o3d.geometry.PointCloud,
+    max_workers: int = 4,
+    env_voxel_size: Optional[float] = None,
+    **kwargs: Any
+) -> List[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """
+    Predict grasps for several items in the same environment concurrently.
+    
+    The environment points are prepared and uploaded once and shared by all
+    requests, which run in a thread pool so the server can work on several
+    items at a time.
+    
+    Parameters:
+        item_clouds: Point clouds of the items to grasp
+        env_cloud: Point cloud of the environment
+        max_workers: Maximum number of concurrent requests
+        env_voxel_size: Voxel size (m) to downsample the environment cloud to (optional)
+        **kwargs: Further arguments for predict_full_grasp
+        
+    Returns:
+        list: (tf_matrices, widths, scores) for each item, in order
+    """
+    if env_voxel_size:
+        env_cloud = env_cloud.voxel_down_sample(env_voxel_size)
+    env_points = pcd_points(np.asarray(env_cloud.points))
+    kwargs.setdefault("reuse_env", True)
+    
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(
+            lambda item_cloud: predict_full_grasp(item_cloud, env_points, **kwargs),
+            item_clouds
+        ))
+
 def get_best_grasp(
     item_cloud: o3d.geometry.PointCloud,
     env_cloud: o3d.geometry.PointCloud,
@@ -211,6 +505,34 @@ def get_best_grasp(
         "score": float(scores[best_idx])
     }
 
+def get_top_k_grasps(
+    item_cloud: o3d.geometry.PointCloud,
+    env_cloud: o3d.geometry.PointCloud | np.ndarray,
+    k: int = 3,
+    **kwargs: Any
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Get the k best grasp poses for an object, best first.
+
+    Parameters:
+        item_cloud: Point cloud of the item to grasp
+        env_cloud: Point cloud of the environment
+        k: Number of grasps to return (fewer if the server found fewer)
+        **kwargs: Further arguments for predict_full_grasp
+
+    Returns:
+        tuple: (tf_matrices, widths, scores) of the k best grasps
+    """
+    tf_matrices, widths, scores = predict_full_grasp(item_cloud, env_cloud, **kwargs)
+
+    # Select the k best in linear time and only sort those
+    if k < len(scores):
+        top_idx = np.argpartition(-scores, k)[:k]
+    else:
+        top_idx = np.arange(len(scores))
+    top_idx = top_idx[np.argsort(-scores[top_idx], kind="stable")]
+    return tf_matrices[top_idx], widths[top_idx], scores[top_idx]
+
 def create_test_point_clouds() -> Tuple[o3d.geometry.PointCloud, o3d.geometry.PointCloud]:
     """
     Create sample point clouds for testing purposes.
@@ -219,23 +541,22 @@ def create_test_point_clouds() -> Tuple[o3d.geometry.PointCloud, o3d.geometry.Po
         tuple: (item_cloud, env_cloud)
     """
     # Create a simple test item cloud (a cube)
-    item_points = []
-    for x in np.linspace(-0.05, 0.05, 10):
-        for y in np.linspace(-0.05, 0.05, 10):
-            for z in np.linspace(0, 0.1, 10):
-                item_points.append([x, y, z])
+    item_points = np.stack(np.meshgrid(
+        np.linspace(-0.05, 0.05, 10),
+        np.linspace(-0.05, 0.05, 10),
+        np.linspace(0, 0.1, 10),
+        indexing="ij"
+    ), axis=-1).reshape(-1, 3)
     
     item_cloud = o3d.geometry.PointCloud()
-    item_cloud.points = o3d.utility.Vector3dVector(np.array(item_points))
+    item_cloud.points = o3d.utility.Vector3dVector(item_points)
     
     # Create a simple environment cloud (a plane)
-    env_points = []
-    for x in np.linspace(-0.2, 0.2, 20):
-        for y in np.linspace(-0.2, 0.2, 20):
-            env_points.append([x, y, -0.01])  # Slightly below the object
+    xs, ys = np.meshgrid(np.linspace(-0.2, 0.2, 20), np.linspace(-0.2, 0.2, 20), indexing="ij")
+    env_points = np.column_stack([xs.ravel(), ys.ravel(), np.full(xs.size, -0.01)])  # Slightly below the object
     
     env_cloud = o3d.geometry.PointCloud()
-    env_cloud.points = o3d.utility.Vector3dVector(np.array(env_points))
+    env_cloud.points = o3d.utility.Vector3dVector(env_points)
     
     return item_cloud, env_cloud
 
@@ -274,11 +595,15 @@ def visualize_grasps(
     # Color for the different grasps (from red=best to blue=worst)
     color_map = plt.cm.jet
     
-    # Normalize scores for coloring
-    if len(scores) > 0:
+    # Normalize scores for coloring, with one colormap call for all grasps
+    if len(scores) > 1:
         score_min = min(scores)
         score_max = max(scores)
         score_range = score_max - score_min if score_max > score_min else 1.0
+        norm_scores = (np.asarray(scores, dtype=np.float64) - score_min) / score_range
+        colors = color_map(norm_scores)[:, :3]  # Get RGB from colormap
+    else:
+        colors = np.tile([1.0, 0.0, 0.0], (len(scores), 1))  # Red for single grasp
     
     # Create a coordinate frame for each grasp
     for i, (transform, width, score) in enumerate(zip(tf_matrices, widths, scores)):
@@ -293,29 +618,24 @@ def visualize_grasps(
         
         # Add the frame to the list
         grasp_frames.append(frame)
+    
+    # Create grasp width visualization (the two finger positions of every grasp)
+    if len(scores) > 0:
+        tf_array = np.asarray(tf_matrices, dtype=np.float64).reshape(-1, 4, 4)
+        half_widths = np.asarray(widths, dtype=np.float64)[:, None] / 2
         
-        # Create grasp width visualization (a line between the fingers)
-        finger_width = width
-        
-        # Calculate finger positions in local coordinate frame
-        # Assuming the gripper closes along the x-axis
-        left_finger = transform @ np.array([-finger_width/2, 0, 0, 1])
-        right_finger = transform @ np.array([finger_width/2, 0, 0, 1])
+        # Fingers sit at -/+ width/2 along the gripper's x-axis (the closing direction)
+        centers = tf_array[:, :3, 3]
+        closing_axes = tf_array[:, :3, 0]
+        finger_points = np.stack([
+            centers - half_widths * closing_axes,
+            centers + half_widths * closing_axes
+        ], axis=1).reshape(-1, 3)
         
-        # Create points for fingers
-        finger_points = np.vstack([left_finger[:3], right_finger[:3]])
+        # Color based on score (normalized)
         finger_cloud = o3d.geometry.PointCloud()
         finger_cloud.points = o3d.utility.Vector3dVector(finger_points)
-        
-        # Color based on score (normalized)
-        if len(scores) > 1:
-            norm_score = (score - score_min) / score_range
-            color = color_map(norm_score)[:3]  # Get RGB from colormap
-        else:
-            color = [1, 0, 0]  # Red for single grasp
-            
-        # Set the color for finger points
-        finger_cloud.paint_uniform_color(color)
+        finger_cloud.colors = o3d.utility.Vector3dVector(np.repeat(colors, 2, axis=0))
         
         # Add to visualization
         visualized_cloud += finger_cloud
@@ -330,20 +650,11 @@ def visualize_grasps(
         print(f"Visualization saved to {save_path}")
         
         # Also save a separate file with only the grasp frames for clarity
+        # (one point per grasp center, colored by score)
         grasp_cloud = o3d.geometry.PointCloud()
-        for i, (transform, width, score) in enumerate(zip(tf_matrices, widths, scores)):
-            # Create points for grasp center
-            center_point = transform[:3, 3]
-            grasp_cloud.points.append(center_point)
-            
-            # Add color based on score
-            if len(scores) > 1:
-                norm_score = (score - score_min) / score_range
-                color = color_map(norm_score)[:3]
-            else:
-                color = [1, 0, 0]  # Red for single grasp
-                
-            grasp_cloud.colors.append(color)
+        centers = np.asarray(tf_matrices, dtype=np.float64).reshape(-1, 4, 4)[:, :3, 3]
+        grasp_cloud.points = o3d.utility.Vector3dVector(np.ascontiguousarray(centers))
+        grasp_cloud.colors = o3d.utility.Vector3dVector(colors)
         
         grasp_frames_path = save_path.replace('.ply', '_grasp_frames.ply')
         o3d.io.write_point_cloud(grasp_frames_path, grasp_cloud)
@@ -1,4 +1,5 @@
 docker run --gpus all -it -p 5000:5000 \
+  --shm-size=2g \
   -v /home/user/azirar/docker_containers/grasp_pose_detection/gpd:/workspace \
   -v /tmp/.X11-unix:/tmp/.X11-unix \
   -e DISPLAY=:2 \
@@ -6,5 +7,5 @@ docker run --gpus all -it -p 5000:5000 \
   -e MESA_GL_VERSION_OVERRIDE=3.3 \
   --net=host \
   gpd \
-  bash -c "Xvfb :1 -ac -screen 2 1024x768x24 -nolisten tcp > /dev/null 2>&1 & sleep 2; export DISPLAY=:2; python3 /workspace/app.py"
+  bash -c "Xvfb :1 -ac -screen 2 1024x768x24 -nolisten tcp > /dev/null 2>&1 & sleep 2; export DISPLAY=:2; gunicorn --chdir /workspace -w 1 -k gthread --threads 8 -b 0.0.0.0:5000 app:app"
 
@@ -1,3 +1,4 @@
+#include <iostream>
 #include <string>
 
 #include <gpd/grasp_detector.h>
@@ -17,18 +18,109 @@ bool checkFileExists(const std::string &file_name) {
   return true;
 }
 
+Eigen::Matrix3Xd readViewPoints(util::ConfigFile &config_file) {
+  // Set the camera position. Assumes a single camera view.
+  std::vector<double> camera_position =
+      config_file.getValueOfKeyAsStdVectorDouble("camera_position",
+                                                 "0.0 0.0 0.0");
+  Eigen::Matrix3Xd view_points(3, 1);
+  view_points << camera_position[0], camera_position[1], camera_position[2];
+  return view_points;
+}
+
+bool detectGraspsInFile(GraspDetector &detector,
+                        const Eigen::Matrix3Xd &view_points,
+                        bool centered_at_origin,
+                        const std::string &pcd_filename,
+                        const std::string &normals_filename) {
+  // Load point cloud from file. A missing or unreadable file yields an empty
+  // cloud, so there is no need to open it once more beforehand.
+  util::Cloud cloud(pcd_filename, view_points);
+  if (cloud.getCloudOriginal()->size() == 0) {
+    std::cout << "Error: Input point cloud is empty or does not exist!\n";
+    return false;
+  }
+
+  // Load surface normals from file.
+  if (!normals_filename.empty()) {
+    cloud.setNormalsFromFile(normals_filename);
+    std::cout << "Loaded surface normals from file: " << normals_filename
+              << "\n";
+  }
+
+  // Preprocess the point cloud.
+  detector.preprocessPointCloud(cloud);
+
+  // If the object is centered at the origin, reverse all surface normals.
+  if (centered_at_origin) {
+    printf("Reversing normal directions ...\n");
+    cloud.setNormals(cloud.getNormals() * (-1.0));
+  }
+
+  // Detect grasp poses.
+  detector.detectGrasps(cloud);
+  return true;
+}
+
+// Keep the detector (and its classifier) loaded and process one PCD file per
+// line read from stdin. Each request is answered with the usual detection
+// output followed by a "DONE" banner, or a "FAILED" banner if the cloud was
+// empty or could not be read, so a client can run many detections without
+// paying for process startup and model loading every time.
+int RunServer(const std::string &config_filename) {
+  util::ConfigFile config_file(config_filename);
+  config_file.ExtractKeys();
+
+  GraspDetector detector(config_filename);
+  Eigen::Matrix3Xd view_points = readViewPoints(config_file);
+  bool centered_at_origin =
+      config_file.getValueOfKey<bool>("centered_at_origin", false);
+  printf("======== READY ========\n");
+  fflush(stdout);
+
+  std::string pcd_filename;
+  while (std::getline(std::cin, pcd_filename)) {
+    if (pcd_filename.empty()) {
+      continue;
+    }
+    bool success = detectGraspsInFile(detector, view_points,
+                                      centered_at_origin, pcd_filename, "");
+    std::cout << std::flush;
+    if (success) {
+      printf("======== DONE ========\n");
+    } else {
+      printf("======== FAILED ========\n");
+    }
+    fflush(stdout);
+  }
+
+  return 0;
+}
+
 int DoMain(int argc, char *argv[]) {
   // Read arguments from command line.
   if (argc < 3) {
     std::cout << "Error: Not enough input arguments!\n\n";
-    std::cout << "Usage: detect_grasps CONFIG_FILE PCD_FILE [NORMALS_FILE]\n\n";
+    std::cout << "Usage: detect_grasps CONFIG_FILE PCD_FILE [NORMALS_FILE]\n";
+    std::cout << "       detect_grasps --server CONFIG_FILE\n\n";
     std::cout << "Detect grasp poses for a point cloud, PCD_FILE (*.pcd), "
                  "using parameters from CONFIG_FILE (*.cfg).\n\n";
     std::cout << "[NORMALS_FILE] (optional) contains a surface normal for each "
-                 "point in the cloud (*.csv).\n";
+                 "point in the cloud (*.csv).\n\n";
+    std::cout << "With --server, PCD file paths are read from stdin, one per "
+                 "line, and the detector is kept loaded between them.\n";
     return (-1);
   }
 
+  if (std::string(argv[1]) == "--server") {
+    std::string config_filename = argv[2];
+    if (!checkFileExists(config_filename)) {
+      printf("Error: config file not found!\n");
+      return (-1);
+    }
+    return RunServer(config_filename);
+  }
+
   std::string config_filename = argv[1];
   std::string pcd_filename = argv[2];
   if (!checkFileExists(config_filename)) {
@@ -44,44 +136,16 @@ int DoMain(int argc, char *argv[]) {
   util::ConfigFile config_file(config_filename);
   config_file.ExtractKeys();
 
-  // Set the camera position. Assumes a single camera view.
-  std::vector<double> camera_position =
-      config_file.getValueOfKeyAsStdVectorDouble("camera_position",
-                                                 "0.0 0.0 0.0");
-  Eigen::Matrix3Xd view_points(3, 1);
-  view_points << camera_position[0], camera_position[1], camera_position[2];
-
-  // Load point cloud from file.
-  util::Cloud cloud(pcd_filename, view_points);
-  if (cloud.getCloudOriginal()->size() == 0) {
-    std::cout << "Error: Input point cloud is empty or does not exist!\n";
-    return (-1);
-  }
-
-  // Load surface normals from file.
-  if (argc > 3) {
-    std::string normals_filename = argv[3];
-    cloud.setNormalsFromFile(normals_filename);
-    std::cout << "Loaded surface normals from file: " << normals_filename
-              << "\n";
-  }
-
   GraspDetector detector(config_filename);
 
-  // Preprocess the point cloud.
-  detector.preprocessPointCloud(cloud);
-
-  // If the object is centered at the origin, reverse all surface normals.
   bool centered_at_origin =
       config_file.getValueOfKey<bool>("centered_at_origin", false);
-  if (centered_at_origin) {
-    printf("Reversing normal directions ...\n");
-    cloud.setNormals(cloud.getNormals() * (-1.0));
+  std::string normals_filename = (argc > 3) ? argv[3] : "";
+  if (!detectGraspsInFile(detector, readViewPoints(config_file),
+                          centered_at_origin, pcd_filename, normals_filename)) {
+    return (-1);
   }
 
-  // Detect grasp poses.
-  detector.detectGrasps(cloud);
-
   return 0;
 }
 
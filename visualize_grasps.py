@@ -4,52 +4,144 @@ Interactive visualization of grasp poses with Open3D.
 This script loads the point clouds and grasp poses and displays them in an interactive viewer.
 """
 
+import hashlib
 import open3d as o3d
 import numpy as np
 import os
 import sys
-import copy
+from concurrent.futures import ThreadPoolExecutor
 
-def create_coordinate_frame(transform_matrix, size=0.05):
-    """Create a coordinate frame at the given pose with the given size."""
-    frame = o3d.geometry.TriangleMesh.create_coordinate_frame(size=size)
-    frame.transform(transform_matrix)
-    return frame
+# Only log errors, instead of Open3D's info messages
+o3d.utility.set_verbosity_level(o3d.utility.VerbosityLevel.Error)
 
-def create_gripper_model(transform_matrix, width, color=[0, 1, 0]):
-    """Create a simple gripper model at the given pose with the given width and color."""
-    # Create base of the gripper
-    base_height = 0.02
-    base_width = 0.04
-    base = o3d.geometry.TriangleMesh.create_box(width=base_width, height=base_height, depth=base_width)
-    
-    # Move base to origin
-    base.translate([-base_width/2, -base_height/2, -base_width/2])
-    
-    # Create fingers
-    finger_width = 0.01
-    finger_height = 0.04
-    finger_depth = 0.02
-    
-    left_finger = o3d.geometry.TriangleMesh.create_box(width=finger_width, height=finger_height, depth=finger_depth)
-    right_finger = o3d.geometry.TriangleMesh.create_box(width=finger_width, height=finger_height, depth=finger_depth)
-    
-    # Position the fingers
-    left_finger.translate([-width/2 - finger_width/2, 0, -finger_depth/2])
-    right_finger.translate([width/2 - finger_width/2, 0, -finger_depth/2])
-    
-    # Combine into one mesh
-    gripper = base
-    gripper += left_finger
-    gripper += right_finger
-    
-    # Paint the gripper
-    gripper.paint_uniform_color(color)
-    
-    # Transform the gripper to the grasp pose
-    gripper.transform(transform_matrix)
-    
-    return gripper
+# The clouds come from our own pipeline and only hold finite points, so the
+# readers skip their NaN/infinity sweeps over every point (older Open3D releases
+# run them by default)
+READ_OPTIONS = dict(remove_nan_points=False, remove_infinite_points=False, print_progress=False)
+
+# Voxel size (meters) the environment cloud is thinned to for display, so large
+# scans stay within what the viewer renders smoothly (None shows every point).
+# Grasps are still detected on the full cloud.
+DISPLAY_VOXEL_SIZE = 0.005
+
+# Gripper dimensions (meters)
+BASE_WIDTH = 0.04
+BASE_HEIGHT = 0.02
+FINGER_WIDTH = 0.01
+FINGER_HEIGHT = 0.04
+FINGER_DEPTH = 0.02
+
+# Unit box, scaled and moved into place for each part of the gripper
+_UNIT_BOX = o3d.geometry.TriangleMesh.create_box()
+_BOX_VERTS = np.asarray(_UNIT_BOX.vertices)
+_BOX_TRIS = np.asarray(_UNIT_BOX.triangles)
+
+# Gripper vertices in the gripper frame: the base centered on the origin, then
+# the left and right finger, both centered on the x-axis for now
+_GRIPPER_VERTS = np.concatenate([
+    _BOX_VERTS * [BASE_WIDTH, BASE_HEIGHT, BASE_WIDTH] + [-BASE_WIDTH/2, -BASE_HEIGHT/2, -BASE_WIDTH/2],
+    _BOX_VERTS * [FINGER_WIDTH, FINGER_HEIGHT, FINGER_DEPTH] + [-FINGER_WIDTH/2, 0, -FINGER_DEPTH/2],
+    _BOX_VERTS * [FINGER_WIDTH, FINGER_HEIGHT, FINGER_DEPTH] + [-FINGER_WIDTH/2, 0, -FINGER_DEPTH/2]
+])
+_GRIPPER_TRIS = np.concatenate([_BOX_TRIS + i * len(_BOX_VERTS) for i in range(3)]).astype(np.int32)
+
+# Shift of each vertex along x per unit of grasp width (the fingers move out to -/+ width/2)
+_FINGER_SHIFT = np.repeat([0.0, -0.5, 0.5], len(_BOX_VERTS))
+
+# Coordinate frame of unit size; frames scale with their size, so it is built
+# once and scaled for every grasp
+_UNIT_FRAME = o3d.geometry.TriangleMesh.create_coordinate_frame(size=1.0)
+_FRAME_VERTS = np.asarray(_UNIT_FRAME.vertices)
+_FRAME_TRIS = np.asarray(_UNIT_FRAME.triangles).astype(np.int32)
+_FRAME_COLORS = np.asarray(_UNIT_FRAME.vertex_colors)
+
+def score_colors(scores):
+    """Map scores to colors from blue (lowest) to red (highest); a single grasp is red."""
+    scores = np.asarray(scores, dtype=np.float64)
+    if len(scores) == 1:
+        return np.array([[1.0, 0.0, 0.0]])
+    score_min = scores.min() if len(scores) else 0.0
+    score_max = scores.max() if len(scores) else 0.0
+    score_range = score_max - score_min if score_max > score_min else 1.0
+    norm_scores = (scores - score_min) / score_range
+    return np.stack([norm_scores, 0.5 * (1 - norm_scores), 1 - norm_scores], axis=1)
+
+def create_grasp_mesh(tf_matrices, widths, colors, frame_size=0.05):
+    """Create a single tensor mesh with a coordinate frame and a colored gripper at every grasp pose.
+    
+    One mesh is drawn in one batch, where separate frames and grippers would
+    each be uploaded and drawn on their own.
+    """
+    tf_matrices = np.asarray(tf_matrices, dtype=np.float64).reshape(-1, 4, 4)
+    widths = np.asarray(widths, dtype=np.float64)
+    num_grasps = len(tf_matrices)
+    
+    # Frame and gripper vertices of every grasp in its own frame, with the
+    # fingers moved out to the grasp's width
+    gripper_verts = np.repeat(_GRIPPER_VERTS[None], num_grasps, axis=0)
+    gripper_verts[:, :, 0] += widths[:, None] * _FINGER_SHIFT
+    local_vertices = np.concatenate([
+        np.broadcast_to(_FRAME_VERTS * frame_size, (num_grasps,) + _FRAME_VERTS.shape),
+        gripper_verts
+    ], axis=1)
+    
+    # Transform all grasps to their poses at once
+    rotations = tf_matrices[:, :3, :3]
+    translations = tf_matrices[:, :3, 3]
+    vertices = local_vertices @ rotations.transpose(0, 2, 1) + translations[:, None, :]
+    
+    # Every grasp has the same triangles, offset into its part of the vertices
+    grasp_triangles = np.concatenate([_FRAME_TRIS, _GRIPPER_TRIS + len(_FRAME_VERTS)])
+    vertices_per_grasp = len(_FRAME_VERTS) + len(_GRIPPER_VERTS)
+    triangles = grasp_triangles + vertices_per_grasp * np.arange(num_grasps)[:, None, None]
+    
+    # Frames keep their axis colors, grippers get their grasp's color on every vertex
+    vertex_colors = np.concatenate([
+        np.broadcast_to(_FRAME_COLORS, (num_grasps,) + _FRAME_COLORS.shape),
+        np.repeat(np.asarray(colors, dtype=np.float64)[:, None, :], len(_GRIPPER_VERTS), axis=1)
+    ], axis=1)
+    
+    # A tensor mesh takes the arrays as they are, without converting them
+    # element-wise into Eigen vectors
+    mesh = o3d.t.geometry.TriangleMesh()
+    mesh.vertex.positions = o3d.core.Tensor.from_numpy(vertices.reshape(-1, 3).astype(np.float32))
+    mesh.triangle.indices = o3d.core.Tensor.from_numpy(triangles.reshape(-1, 3).astype(np.int32))
+    mesh.vertex.colors = o3d.core.Tensor.from_numpy(vertex_colors.reshape(-1, 3).astype(np.float32))
+    return mesh
+
+def load_or_predict_grasps(item_cloud, env_cloud):
+    """Get grasps for the clouds from the server, or from disk if they were detected before.
+    
+    Results are cached in a grasps_<hash>.npz file per pair of input clouds and
+    request parameters, so unchanged inputs skip the (up to two minute) round
+    trip to the server. Empty results are not cached.
+    """
+    params = dict(
+        server_ip="127.0.0.1",
+        server_port=5000,
+        rotation_resolution=32,
+        top_n=100,
+        n_best=3,
+        timeout=120
+    )
+    
+    digest = hashlib.sha1(repr(sorted(params.items())).encode())
+    digest.update(np.asarray(item_cloud.points).tobytes())
+    digest.update(np.asarray(env_cloud.points).tobytes())
+    cache_path = f"grasps_{digest.hexdigest()[:16]}.npz"
+    
+    if os.path.exists(cache_path):
+        print(f"Loading cached grasps from {cache_path}")
+        with np.load(cache_path) as cached:
+            return cached["tf_matrices"], cached["widths"], cached["scores"]
+    
+    # Only needed when asking the server
+    from graspnet_interface import predict_full_grasp
+    
+    tf_matrices, widths, scores = predict_full_grasp(item_cloud, env_cloud, **params)
+    if len(scores):
+        np.savez_compressed(cache_path, tf_matrices=tf_matrices, widths=widths, scores=scores)
+    return tf_matrices, widths, scores
 
 def visualize_grasps():
     """Load point clouds and grasp poses and visualize them."""
@@ -63,8 +155,11 @@ def visualize_grasps():
         print(f"Error: Point cloud files not found: {item_cloud_path} or {env_cloud_path}")
         return
     
-    item_cloud = o3d.io.read_point_cloud(item_cloud_path)
-    env_cloud = o3d.io.read_point_cloud(env_cloud_path)
+    # Read both in parallel; Open3D releases the GIL while parsing
+    with ThreadPoolExecutor(2) as executor:
+        item_future = executor.submit(o3d.io.read_point_cloud, item_cloud_path, **READ_OPTIONS)
+        env_future = executor.submit(o3d.io.read_point_cloud, env_cloud_path, **READ_OPTIONS)
+        item_cloud, env_cloud = item_future.result(), env_future.result()
     
     # Load grasp visualization file
     grasp_vis_path = "grasp_visualization.ply"
@@ -77,23 +172,25 @@ def visualize_grasps():
         return
     
     # Load grasp frames
-    grasp_frames = o3d.io.read_point_cloud(grasp_frames_path)
+    grasp_frames = o3d.io.read_point_cloud(grasp_frames_path, **READ_OPTIONS)
     
     # Create visualization geometries
     vis_geometries = []
     
     # Add point clouds
+    # The clouds are painted in place: grasp detection only uses their points
     # Make environment cloud gray
-    env_cloud_colored = copy.deepcopy(env_cloud)
-    if not env_cloud_colored.has_colors():
-        env_cloud_colored.paint_uniform_color([0.8, 0.8, 0.8])
-    vis_geometries.append(env_cloud_colored)
+    env_display_cloud = env_cloud
+    if DISPLAY_VOXEL_SIZE:
+        env_display_cloud = env_cloud.voxel_down_sample(DISPLAY_VOXEL_SIZE)
+    if not env_display_cloud.has_colors():
+        env_display_cloud.paint_uniform_color([0.8, 0.8, 0.8])
+    vis_geometries.append({"name": "environment", "geometry": env_display_cloud})
     
     # Make item cloud blue
-    item_cloud_colored = copy.deepcopy(item_cloud)
-    if not item_cloud_colored.has_colors():
-        item_cloud_colored.paint_uniform_color([0.0, 0.0, 1.0])
-    vis_geometries.append(item_cloud_colored)
+    if not item_cloud.has_colors():
+        item_cloud.paint_uniform_color([0.0, 0.0, 1.0])
+    vis_geometries.append({"name": "item", "geometry": item_cloud})
     
     # Load grasp data from the server response
     # This is a simplification - in a real application, you'd load the actual grasp data
@@ -101,42 +198,22 @@ def visualize_grasps():
     
     try:
         print("Getting transforms from grasp detection results...")
-        # Try to load from the test script output
-        from graspnet_interface import test_grasp_detection, predict_full_grasp
+        # Get the transformation matrices, from the server or an earlier run
+        tf_matrices, widths, scores = load_or_predict_grasps(item_cloud, env_cloud)
         
-        # Get the transformation matrices from the test function
-        tf_matrices, widths, scores = predict_full_grasp(
-            item_cloud,
-            env_cloud,
-            rotation_resolution=32,
-            top_n=100,
-            n_best=3,
-            timeout=120
-        )
+        # Report all grasps in one print instead of one per grasp
+        print("\n".join(
+            [f"Found {len(scores)} grasps"] +
+            [f"  grasp {i+1}: score={score:.3f}" for i, score in enumerate(scores)]
+        ))
         
-        print(f"Found {len(scores)} grasps")
+        # Map scores to colors (red for high score, blue for low score)
+        colors = score_colors(scores)
         
-        # Create a coordinate frame for each grasp
-        for i, (transform, width, score) in enumerate(zip(tf_matrices, widths, scores)):
-            print(f"Adding grasp {i+1} with score {score}")
-            
-            # Create coordinate frame
-            frame = create_coordinate_frame(transform, size=0.05)
-            vis_geometries.append(frame)
-            
-            # Create gripper model
-            # Map score to a color (red for high score, blue for low score)
-            if len(scores) > 1:
-                score_min = min(scores)
-                score_max = max(scores)
-                score_range = score_max - score_min if score_max > score_min else 1.0
-                norm_score = (score - score_min) / score_range
-                color = [norm_score, 0.5*(1-norm_score), 1-norm_score]  # red to blue
-            else:
-                color = [1, 0, 0]  # Red for single grasp
-            
-            gripper = create_gripper_model(transform, width, color)
-            vis_geometries.append(gripper)
+        # Add a coordinate frame and gripper for each grasp, all in one mesh
+        if len(scores):
+            grasp_mesh = create_grasp_mesh(tf_matrices, widths, colors, frame_size=0.05)
+            vis_geometries.append({"name": "grasps", "geometry": grasp_mesh})
     
     except Exception as e:
         print(f"Warning: Could not load grasp data: {e}")
@@ -144,35 +221,23 @@ def visualize_grasps():
     
         # Just add the grasp center points
         if grasp_frames.has_points():
-            vis_geometries.append(grasp_frames)
+            vis_geometries.append({"name": "grasp centers", "geometry": grasp_frames})
     
-    # Set up the visualizer
+    # Run the visualizer. It renders with Filament, takes the tensor grasp mesh
+    # as it is and frames the camera on the scene; its side panel has the
+    # display settings
     print("Starting visualizer...")
-    vis = o3d.visualization.VisualizerWithKeyCallback()
-    vis.create_window("Grasp Visualization")
-    
-    # Add geometries to the visualizer
-    for geom in vis_geometries:
-        vis.add_geometry(geom)
-    
-    # Set up the camera position
-    ctr = vis.get_view_control()
-    ctr.set_front([-1, -1, -1])
-    ctr.set_lookat([0, 0, 0])
-    ctr.set_up([0, 1, 0])
-    ctr.set_zoom(0.8)
-    
-    # Add keyboard instructions
-    print("\nKeyboard controls:")
-    print("  Q/Esc: Quit the visualizer")
-    print("  H: Show help")
-    print("  R: Reset camera view")
-    print("  ,/.: Decrease/Increase size of points")
-    print("  Mouse: Rotate/Pan/Zoom the view")
-    
-    # Run the visualizer
-    vis.run()
-    vis.destroy_window()
+    print("Mouse: Rotate/Pan/Zoom the view, close the window to quit")
+    o3d.visualization.draw(
+        vis_geometries,
+        title="Grasp Visualization",
+        show_ui=True,
+        bg_color=(1.0, 1.0, 1.0, 1.0),
+        point_size=2,
+        # The scene is static, so skip the image-based lighting and skybox
+        raw_mode=True,
+        show_skybox=False
+    )
 
 if __name__ == "__main__":
     visualize_grasps()